@@ -1,10 +1,33 @@
 import bpy
 from bpy.types import Operator, Panel
 import math
-import statistics  
+import numpy as np
+
+BEZIER = bpy.types.Keyframe.bl_rna.properties["interpolation"].enum_items["BEZIER"].value
+AUTO_CLAMPED = bpy.types.Keyframe.bl_rna.properties["handle_left_type"].enum_items["AUTO_CLAMPED"].value
+
+# Stored keyframe properties as (name, components, dtype), for bulk copies
+KEYFRAME_PROPERTIES = (
+    ("co", 2, np.float32),
+    ("handle_left", 2, np.float32),
+    ("handle_right", 2, np.float32),
+    ("interpolation", 1, np.int32),
+    ("easing", 1, np.int32),
+    ("handle_left_type", 1, np.int32),
+    ("handle_right_type", 1, np.int32),
+    ("type", 1, np.int32),
+    ("back", 1, np.float32),
+    ("amplitude", 1, np.float32),
+    ("period", 1, np.float32),
+    ("select_control_point", 1, bool),
+    ("select_left_handle", 1, bool),
+    ("select_right_handle", 1, bool),
+)
     
-def estimate_previous_velocity(fcurve, frame, num_samples=3, std_threshold=0.1, fake=False):
+def estimate_previous_velocity(fcurve, frame, num_samples=3, rmse_threshold=0.1, fake=False):
     # Returns estimated slope of existing keyframe by sampling previous curve
+    # rmse_threshold is in curve value units: how far the samples may stray
+    # from the fitted line before the most recent slope is used instead
 
     if fake:
         # Rotation curves get no normalization
@@ -13,78 +36,230 @@ def estimate_previous_velocity(fcurve, frame, num_samples=3, std_threshold=0.1,
         else:
             return 0.5
 
-    current_value = fcurve.evaluate(frame)
-
-    # Collect backward samples
-    samples = []
-    for i in range(1, num_samples + 1):
-        prev_frame = frame - i
-        prev_value = fcurve.evaluate(prev_frame)
-        samples.append((prev_frame, prev_value))
-
-    # Compute slopes
-    slopes = []
-    for prev_frame, prev_value in samples:
-        dx = frame - prev_frame
-        dy = current_value - prev_value
-        if dx != 0:
-            slopes.append(dy / dx)
-
-    if not slopes:
+    if num_samples < 1:
         return 0.0
 
-    # Sign consistency check
-    signs = [1 if s > 0 else -1 if s < 0 else 0 for s in slopes]
-    consistent_sign = all(s == signs[0] for s in signs)
-
-    # Standard deviation check
-    slope_std = statistics.pstdev(slopes) if len(slopes) > 1 else 0.0
+    # Sample the curve backwards from the keyframe
+    ts = np.arange(frame - num_samples, frame + 1, dtype=np.float64)
+    ys = np.fromiter((fcurve.evaluate(t) for t in ts), dtype=np.float64, count=len(ts))
 
-    # If unstable, return most recent slope (slopes[0])
-    if not consistent_sign or slope_std > std_threshold:
-        return slopes[0]
-    
-    # Otherwise return median slope
-    return statistics.median(slopes)
-    
-def find_keyframe_at_frame(fcurve, frame):
-    target = int(frame)
+    # Least-squares slope through the samples
+    centered = ts - ts.mean()
+    slope = (centered * ys).sum() / (centered * centered).sum()
 
-    for kp in fcurve.keyframe_points:
-        if int(kp.co[0]) == target:
-            return kp
+    # If the samples don't lie close to that line, return most recent slope
+    residuals = ys - (ys.mean() + slope * centered)
+    rmse = math.sqrt((residuals * residuals).mean())
+    if rmse > rmse_threshold:
+        return float(ys[-1] - ys[-2])
 
-    return None
+    return float(slope)
+    
+def spring_response(k, c, max_iter):
+    # Evaluates the spring in closed form at every frame after the keyframe
+    # for a unit incoming velocity. The motion is linear in the velocity, so
+    # one evaluation serves every fcurve baked with the same settings.
+    # Returns the per-frame offsets and velocities.
+    omega = math.sqrt(k)
+    zeta = c / (2 * omega)
+    t = np.arange(1, max_iter + 1, dtype=np.float64)
+
+    # Undamped oscillation out of rest
+    x = np.sin(omega * t) / omega
+    v = np.cos(omega * t)
+
+    # Delay damping until first peak (velocity sign change), then decay
+    # from the state reached on that frame
+    flipped = np.flatnonzero(v < 0)
+    if flipped.size:
+        start = flipped[0]
+        x0 = x[start]
+        v0 = v[start]
+        tau = t[start + 1:] - t[start]
+        envelope = np.exp(-zeta * omega * tau)
+
+        if zeta < 1:
+            omega_d = omega * math.sqrt(1 - zeta * zeta)
+            b = (v0 + zeta * omega * x0) / omega_d
+            cos_d = np.cos(omega_d * tau)
+            sin_d = np.sin(omega_d * tau)
+            x[start + 1:] = envelope * (x0 * cos_d + b * sin_d)
+            v[start + 1:] = envelope * ((b * omega_d - zeta * omega * x0) * cos_d
+                                        - (x0 * omega_d + zeta * omega * b) * sin_d)
+        else:
+            # Critically damped
+            b = v0 + omega * x0
+            x[start + 1:] = envelope * (x0 + b * tau)
+            v[start + 1:] = envelope * (b - omega * (x0 + b * tau))
+
+    return x, v
+
+
+def settle_count(unit_offsets, unit_velocities, velocity, epsilon):
+    # Returns how many frames to bake for the given velocity: motion has died
+    # once both offset and velocity fall under epsilon, and that frame is
+    # still baked
+    if abs(velocity) <= epsilon:
+        return 0
+
+    threshold = epsilon / abs(velocity)
+    settled = (np.abs(unit_offsets) <= threshold) & (np.abs(unit_velocities) <= threshold)
+    return int(np.argmax(settled)) + 1 if settled.any() else len(unit_offsets)
+
+
+def fill_baked_coords(out_co, unit_offsets, velocity, kf_frame, kf_value):
+    # Fills out_co, a preallocated (N, 2) float32 block, with the spring's
+    # unit response scaled by velocity and offset from the keyframe, in the
+    # (frame, value) layout foreach_set("co") takes
+    count = len(out_co)
+    frames = out_co[:, 0]
+    values = out_co[:, 1]
+
+    frames[:] = np.arange(1, count + 1)
+    frames += kf_frame
+
+    np.multiply(unit_offsets[:count], velocity, out=values, casting='same_kind')
+    values += kf_value
+
+
+def read_keyframe_coords(fcurve):
+    # Bulk-reads every keyframe's (frame, value) into an (N, 2) array
+    keyframe_points = fcurve.keyframe_points
+    co = np.empty(2 * len(keyframe_points), dtype=np.float32)
+    keyframe_points.foreach_get("co", co)
+    return co.reshape(-1, 2)
+
+
+def write_new_rows(keyframe_points, start, attr, width, dtype, values):
+    # foreach_set covers the whole collection, so read it back and only
+    # replace the rows from start onwards
+    buf = np.empty(len(keyframe_points) * width, dtype=dtype)
+    keyframe_points.foreach_get(attr, buf)
+    buf.reshape(-1, width)[start:] = values
+    keyframe_points.foreach_set(attr, buf)
+
+
+def rebuild_keyframes(fcurve, keep, baked_co):
+    # Writes the baked keys onto the curve. When keep drops keys, the curve is
+    # rewritten as the kept keys plus the baked ones in a single clear/add
+    # cycle instead of removing keys one at a time
+    keyframe_points = fcurve.keyframe_points
+    existing = len(keyframe_points)
+    kept = int(np.count_nonzero(keep))
+    baked = len(baked_co)
+    if kept == existing and baked == 0:
+        return False
+
+    if kept == existing:
+        # Nothing is dropped: append the baked keys and only write co and
+        # interpolation, which are the only values that differ from
+        # add()'s defaults
+        keyframe_points.add(baked)
+        write_new_rows(keyframe_points, existing, "co", 2, np.float32, baked_co)
+        write_new_rows(keyframe_points, existing, "interpolation", 1, np.int32, BEZIER)
+        return True
+
+    # Snapshot everything stored on the keys that survive
+    survivors = {}
+    for attr, width, dtype in KEYFRAME_PROPERTIES:
+        buf = np.empty(existing * width, dtype=dtype)
+        keyframe_points.foreach_get(attr, buf)
+        survivors[attr] = buf.reshape(-1, width)[keep]
+
+    keyframe_points.clear()
+    keyframe_points.add(kept + baked)
+
+    # Baked keys start from the defaults add() gives them (selected,
+    # auto clamped); new points are unsorted until fcurve.update()
+    for attr, width, dtype in KEYFRAME_PROPERTIES:
+        buf = np.empty((kept + baked) * width, dtype=dtype)
+        keyframe_points.foreach_get(attr, buf)
+        rows = buf.reshape(-1, width)
+        rows[:kept] = survivors[attr]
+        if attr == "co":
+            rows[kept:] = baked_co
+        elif attr == "interpolation":
+            rows[kept:] = BEZIER
+        keyframe_points.foreach_set(attr, buf)
+
+    return True
 
     
-def build_selected_map(self, fcurves):
+def finalize_keyframes(fcurve, rebuilt):
+    # Final cleanup: deselect + smart handle types
+    # rebuilt: keys were rewritten by rebuild_keyframes() and need sorting
+    keyframe_points = fcurve.keyframe_points
+    n = len(keyframe_points)
+
+    # Snapshot selection once, before we deselect
+    was_selected = np.empty(n, dtype=bool)
+    keyframe_points.foreach_get("select_control_point", was_selected)
+    needs_update = rebuilt
+
+    # Selected Bezier keys (the freshly baked ones) → force AUTO_CLAMPED handles
+    if was_selected.any():
+        ipo = np.empty(n, dtype=np.int32)
+        keyframe_points.foreach_get("interpolation", ipo)
+        need_auto = was_selected & (ipo == BEZIER)
+
+        if need_auto.any():
+            handle_types = np.empty(n, dtype=np.int32)
+            for attr in ("handle_left_type", "handle_right_type"):
+                keyframe_points.foreach_get(attr, handle_types)
+                handle_types[need_auto] = AUTO_CLAMPED
+                keyframe_points.foreach_set(attr, handle_types)
+            needs_update = True
+
+    # Deselect everything
+    deselected = np.zeros(n, dtype=bool)
+    for attr in ("select_control_point", "select_left_handle", "select_right_handle"):
+        keyframe_points.foreach_set(attr, deselected)
+
+    # Important after handle changes; selection alone doesn't need it
+    if needs_update:
+        fcurve.update()
+
+
+def selected_indices(fcurve):
+    # Indices of selected keyframes, from one bulk read of the selection
+    mask = np.empty(len(fcurve.keyframe_points), dtype=bool)
+    fcurve.keyframe_points.foreach_get("select_control_point", mask)
+    return np.flatnonzero(mask)
+
+
+def build_selected_map(operator, fcurves):
     #selected_map: { fcurve: [(frame, value)] }
 
     selected_map = {}
 
     for fc in fcurves:
-        selected = [kp for kp in fc.keyframe_points if kp.select_control_point]
+        selected = selected_indices(fc)
 
         # Abort PER F-CURVE if more than one keyframe is selected
-        if len(selected) > 1:
-            self.report({'ERROR'}, "Select exactly one keyframe per fcurve")
+        if selected.size > 1:
+            operator.report({'ERROR'}, "Select exactly one keyframe per fcurve")
             return None  
 
         # Store exactly one selected keyframe
-        if len(selected) == 1:
-            kp = selected[0]
+        if selected.size == 1:
+            kp = fc.keyframe_points[int(selected[0])]
             selected_map[fc] = [(kp.co[0], kp.co[1])]
 
     return selected_map
     
 def reselect_keys(selected_map):
     for fc, key_list in selected_map.items():
+        frames = read_keyframe_coords(fc)[:, 0]
+        selected = np.empty(len(frames), dtype=bool)
+        fc.keyframe_points.foreach_get("select_control_point", selected)
+
         for frame, value in key_list:
-            # Find the actual keyframe object after decimation
-            for kp in fc.keyframe_points:
-                if abs(kp.co[0] - frame) < 1e-6:
-                    kp.select_control_point = True
-                    break
+            # Find the actual keyframe after decimation
+            idx = np.flatnonzero(np.abs(frames - frame) < 1e-6)
+            if idx.size:
+                selected[idx[0]] = True
+
+        fc.keyframe_points.foreach_set("select_control_point", selected)
     
     
 class VelocityOperator(Operator):
@@ -151,14 +326,26 @@ class VelocityOperator(Operator):
         map = build_selected_map(self, fcurves)
         if map is None:
             return {'CANCELLED'}
+        
+        # Spring parameters only depend on the operator settings, so the
+        # response is evaluated once here and scaled per fcurve
+        omega = (2 * math.pi) / (self.timing + 1)
+        k = omega * omega
+        decay_remapped = self.decay ** 3  # your existing non-linear remap
+        c = 2 * decay_remapped * math.sqrt(k) if k > 0 else 0
+        
+        max_iter = 500
+        unit_offsets, unit_velocities = spring_response(k, c, max_iter)
+        
         for fcurve in fcurves:
 
             # Find selected keyframe
-            selected = [kf for kf in fcurve.keyframe_points if kf.select_control_point]
-            if len(selected) != 1:
+            selected = selected_indices(fcurve)
+            if selected.size != 1:
+                finalize_keyframes(fcurve, False)
                 continue
             
-            kf = selected[0]
+            kf = fcurve.keyframe_points[int(selected[0])]
             kf_frame = kf.co[0]
             kf_value = kf.co[1]
             kf.select_control_point = False            
@@ -167,93 +354,44 @@ class VelocityOperator(Operator):
             velocity = estimate_previous_velocity(fcurve, kf_frame, fake=self.fake_velocity)
             velocity *= self.amplitude
             
-            # Identify owner
-            owner = fcurve.id_data
-            fcurve_key = f"{fcurve.data_path}_{fcurve.array_index}"
-
-            # Spring parameters
-            omega = (2 * math.pi) / (self.timing + 1)
-            k = omega * omega
-            decay_remapped = self.decay ** 3  # your existing non-linear remap
-            c = 2 * decay_remapped * math.sqrt(k) if k > 0 else 0
-            
-            # Simulation state
-            x = 0.0
-            v = velocity
-            
             initial_magnitude = abs(velocity) + 1e-6
             epsilon = initial_magnitude * 1e-2
             
-            max_iter = 500
-            frame = kf_frame
-            iter_count = 0
-            substeps = 50
-            dt = 1.0 / substeps
+            count = settle_count(unit_offsets, unit_velocities, velocity, epsilon)
             
-            # Delay damping until first peak (velocity sign change)
-            damping_active = False
-            prev_v_sign = 1 if v >= 0 else -1 # initial direction
+            # Every key the simulation would bake, before collision checks
+            baked_co = np.empty((count, 2), dtype=np.float32)
+            fill_baked_coords(baked_co, unit_offsets, velocity, kf_frame, kf_value)
             
-            # Simulate forward until motion dies
-            while (abs(x) > epsilon or abs(v) > epsilon) and iter_count < max_iter:
-                for _ in range(substeps):
-                    c_current = c if damping_active else 0.0
-                    a = -k * x - c_current * v
-                    v += a * dt
-                    x += v * dt
-                
-                # Detect first peak and start decay function after
-                current_v_sign = 1 if v >= 0 else -1
-                if not damping_active and current_v_sign != prev_v_sign and current_v_sign != 0:
-                    damping_active = True
-                prev_v_sign = current_v_sign
-
-                next_frame = frame + 1
-                existing = find_keyframe_at_frame(fcurve, next_frame)
-
-                # Abort baking if overwrite is disabled and a keyframe exists
-                if existing and not self.overwrite_keyframes:
-                    break
-
-                frame = next_frame
-                value = kf_value + x
-
-                # Overwrite existing keyframe if allowed
-                if existing and self.overwrite_keyframes:
-                    fcurve.keyframe_points.remove(existing)
-
-                kp = fcurve.keyframe_points.insert(frame=frame, value=value)
-                kp.interpolation = 'BEZIER'
-
-                iter_count += 1
-
+            # Existing keys by integer frame; astype truncates toward zero like int()
+            key_frames = read_keyframe_coords(fcurve)[:, 0].astype(np.int64)
+            bake_ints = baked_co[:, 0].astype(np.int64)
+            keep = np.ones(len(key_frames), dtype=bool)
+            iter_count = count
             
+            if count:
+                # Keys are sorted by frame, so the ones landing on baked frames
+                # form a single index range
+                lo = np.searchsorted(key_frames, bake_ints[0], side='left')
+                hi = np.searchsorted(key_frames, bake_ints[-1], side='right')
+
+                if lo < hi:
+                    if self.overwrite_keyframes:
+                        # Overwrite existing keyframes if allowed
+                        keep[lo:hi] = False
+                    else:
+                        # Abort baking at the first existing keyframe
+                        iter_count = int(np.searchsorted(bake_ints, key_frames[lo], side='left'))
+
+            # Drop overwritten keys and write the bake in one pass
+            rebuilt = rebuild_keyframes(fcurve, keep, baked_co[:iter_count])
+
             if iter_count >= max_iter:
                 self.report({'WARNING'}, "Simulation capped — adjust decay or timing")
             
-            fcurve.update()
+            finalize_keyframes(fcurve, rebuilt)
             processed += 1
         
-        #for fcurve in fcurves:
-        # ─── Final cleanup: deselect + smart handle types ────────────────────────
-        for fcurve in fcurves:
-            for kp in fcurve.keyframe_points:
-                was_selected = kp.select_control_point  # remember before we deselect
-
-                # Deselect everything
-                kp.select_control_point = False
-                kp.select_left_handle = False
-                kp.select_right_handle = False
-
-                # If this keyframe is (or was) selected → force AUTO_CLAMPED handles
-                # This catches both: original selected key AND any re-selected via reselect_keys()
-                if was_selected or kp.select_control_point:  # second check is safety
-                    if kp.interpolation == 'BEZIER':
-                        kp.handle_left_type = 'AUTO_CLAMPED'
-                        kp.handle_right_type = 'AUTO_CLAMPED'
-
-            fcurve.update()  # Important after handle changes
-                
         reselect_keys(map)
             
         if processed == 0: